@@ -2,21 +2,20 @@ import os
 import tempfile
 import logging
 import re
-import zipfile
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+import subprocess
+from email.message import EmailMessage
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import multiprocessing
+import atexit
 from flask import Flask, render_template, request, jsonify, send_from_directory
-from googleapiclient.discovery import build
 import yt_dlp
-from pydub import AudioSegment
+import isodate
 import time
 import random
+import threading
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -27,6 +26,7 @@ load_dotenv()
 api_key = os.getenv('YOUTUBE_API_KEY')
 sender_email = os.getenv('SENDER_EMAIL')
 email_password = os.getenv('EMAIL_PASSWORD')
+use_tmpfs = os.getenv('MASHUP_TMPFS') == '1'
 
 
 if not all([api_key, sender_email, email_password]):
@@ -34,31 +34,76 @@ if not all([api_key, sender_email, email_password]):
     raise ValueError("Missing environment variables. Please check your .env file.")
 
 num_cores = multiprocessing.cpu_count()
+download_workers = min(num_cores, 8)
+
+tmp_dir = '/dev/shm' if use_tmpfs and os.path.isdir('/dev/shm') else None
+
+download_pool = ProcessPoolExecutor(max_workers=download_workers)
+atexit.register(download_pool.shutdown)
+
+smtp_lock = threading.Lock()
+smtp_server = None
+youtube_local = threading.local()
+
+EMAIL_RE = re.compile(r'^[\w\.-]+@[\w\.-]+\.\w+$')
+
+SEARCH_CACHE_TTL = 3600
 
 
 def is_valid_email(email):
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(pattern, email) is not None
+    return EMAIL_RE.match(email) is not None
+
+
+def get_youtube_client(api_key):
+    youtube = getattr(youtube_local, 'client', None)
+    if youtube is None:
+        from googleapiclient.discovery import build
+        youtube = build('youtube', 'v3', developerKey=api_key, cache_discovery=False)
+        youtube_local.client = youtube
+    return youtube
+
+
+@lru_cache(maxsize=256)
+def cached_youtube_search(api_key, query, max_results, ttl_bucket):
+    # ttl_bucket only takes part in the cache key, so entries expire when it changes
+    youtube = get_youtube_client(api_key)
+    search_response = youtube.search().list(
+        q=query,
+        part='snippet',
+        type='video',
+        maxResults=max_results
+    ).execute()
+
+    items = search_response['items']
+    video_ids = [item['id']['videoId'] for item in items]
+    if not video_ids:
+        return ()
+
+    details_response = youtube.videos().list(
+        id=','.join(video_ids),
+        part='contentDetails'
+    ).execute()
+    durations = {
+        item['id']: isodate.parse_duration(item['contentDetails']['duration']).total_seconds()
+        for item in details_response['items']
+    }
+
+    videos = []
+    for item in items:
+        video_id = item['id']['videoId']
+        if video_id not in durations:
+            continue
+        video_title = item['snippet']['title']
+        video_url = f"https://www.youtube.com/watch?v={video_id}"
+        videos.append((video_title, video_url, durations[video_id]))
+
+    return tuple(videos)
 
 
 def get_youtube_links(api_key, query, max_results=20):
     try:
-        youtube = build('youtube', 'v3', developerKey=api_key)
-        search_response = youtube.search().list(
-            q=query,
-            part='snippet',
-            type='video',
-            maxResults=max_results
-        ).execute()
-
-        videos = []
-        for item in search_response['items']:
-            video_id = item['id']['videoId']
-            video_title = item['snippet']['title']
-            video_url = f"https://www.youtube.com/watch?v={video_id}"
-            videos.append((video_title, video_url))
-
-        return videos
+        ttl_bucket = int(time.time() // SEARCH_CACHE_TTL)
+        return list(cached_youtube_search(api_key, query, max_results, ttl_bucket))
     except Exception as e:
         logging.error(f"Failed to fetch YouTube links: {e}")
         return []
@@ -67,12 +112,10 @@ def download_single_audio(url, index, download_path):
     ydl_opts = {
     'format': 'bestaudio/best',
     'outtmpl': f'{download_path}/song_{index}.%(ext)s',
-    'postprocessors': [{
-        'key': 'FFmpegExtractAudio',
-        'preferredcodec': 'mp3',
-        'preferredquality': '192',
-    }],
     'retries': 10,
+    'buffersize': 65536,
+    'http_chunk_size': 10485760,
+    'concurrent_fragment_downloads': 4,
     'proxy': 'socks5://127.0.0.1:9050', 
     'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3',  # Spoof user agent
 }
@@ -85,10 +128,10 @@ def download_single_audio(url, index, download_path):
             time.sleep(random.uniform(1, 5))
             
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([url])
-            downloaded_files = [f for f in os.listdir(download_path) if f.startswith(f"song_{index}.") and f.endswith(".mp3")]
-            if downloaded_files:
-                return os.path.join(download_path, downloaded_files[0])
+                info_dict = ydl.extract_info(url, download=True)
+                audio_file = info_dict['requested_downloads'][0]['filepath']
+            if os.path.exists(audio_file):
+                return audio_file
             else:
                 logging.error(f"Downloaded file not found for {url}")
                 return None
@@ -104,81 +147,106 @@ def download_single_audio(url, index, download_path):
 
 
 def download_all_audio(video_urls, download_path):
+    video_urls = list(dict.fromkeys(video_urls))
     downloaded_files = []
-    with ThreadPoolExecutor(max_workers=num_cores) as executor:
-        futures = {
-            executor.submit(download_single_audio, url, index, download_path): index
-            for index, url in enumerate(video_urls, start=1)
-        }
+    futures = {
+        download_pool.submit(download_single_audio, url, index, download_path): index
+        for index, url in enumerate(video_urls, start=1)
+    }
 
-        for future in as_completed(futures):
-            try:
-                mp3_file = future.result()
-                if mp3_file:
-                    downloaded_files.append(mp3_file)
-            except Exception as e:
-                logging.error(f"Error occurred: {e}")
+    for future in as_completed(futures):
+        try:
+            audio_file = future.result()
+            if audio_file:
+                downloaded_files.append(audio_file)
+        except Exception as e:
+            logging.error(f"Error occurred: {e}")
 
     return downloaded_files
 
 
-def create_mashup(audio_files, output_file, trim_duration):
-    mashup = AudioSegment.silent(duration=0)
-    total_trim_duration_per_file = trim_duration * 1000 
-
-    for file in audio_files:
-        try:
-            audio = AudioSegment.from_file(file)
-            if len(audio) < total_trim_duration_per_file:
-                logging.warning(f"Audio file {file} is shorter than trim duration. Using full length.")
-                part = audio
-            else:
-                part = audio[:total_trim_duration_per_file]
-            mashup += part
-        except Exception as e:
-            logging.error(f"Error processing file {file}: {e}")
-
-    if len(mashup) == 0:
+def create_mashup(audio_files, output_file, trim_duration, start_offset=0):
+    n = len(audio_files)
+    if n == 0:
         logging.error("No audio files were successfully processed.")
         return None
 
-    expected_mashup_duration = total_trim_duration_per_file * len(audio_files)
-    if len(mashup) < expected_mashup_duration:
-        logging.warning(f"Mashup duration ({len(mashup)}ms) is less than expected ({expected_mashup_duration}ms).")
-    else:
-        mashup = mashup[:expected_mashup_duration]
+    inputs = sum([["-ss", str(start_offset), "-t", str(trim_duration), "-i", file] for file in audio_files], [])
+    filter_complex = "".join(f"[{i}:a]" for i in range(n)) + f"concat=n={n}:v=0:a=1[out]"
+
+    result = subprocess.run(
+        ["ffmpeg", "-y"] + inputs + [
+            "-filter_complex", filter_complex,
+            "-map", "[out]",
+            "-b:a", "128k",
+            output_file
+        ],
+        capture_output=True
+    )
+    if result.returncode != 0 or not os.path.exists(output_file):
+        logging.error(f"ffmpeg failed to create mashup: {result.stderr.decode(errors='replace')}")
+        return None
 
-    mashup.export(output_file, format="mp3", bitrate="128k")
     return output_file
 
-def create_zip_file(file_path, zip_path):
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        zipf.write(file_path, os.path.basename(file_path))
-    return zip_path
+def get_smtp_connection(sender_email, password):
+    global smtp_server
+    if smtp_server is not None:
+        try:
+            if smtp_server.noop()[0] == 250:
+                return smtp_server
+        except (smtplib.SMTPException, OSError):
+            pass
+        logging.info("SMTP connection is stale, reconnecting")
+
+    smtp_server = smtplib.SMTP_SSL('smtp.gmail.com', 465, timeout=30)
+    smtp_server.login(sender_email, password)
+    return smtp_server
+
+
+def close_smtp_connection():
+    global smtp_server
+    with smtp_lock:
+        if smtp_server is not None:
+            try:
+                smtp_server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            smtp_server = None
+
+
+atexit.register(close_smtp_connection)
 
 
 def send_email(sender_email, receiver_email, subject, body, attachment_path, password):
     try:
-        msg = MIMEMultipart()
+        msg = EmailMessage()
         msg['From'] = sender_email
         msg['To'] = receiver_email
         msg['Subject'] = subject
 
-        msg.attach(MIMEText(body, 'plain'))
+        msg.set_content(body)
 
         with open(attachment_path, 'rb') as attachment:
-            part = MIMEBase('application', 'zip')
-            part.set_payload(attachment.read())
-            encoders.encode_base64(part)
-            part.add_header('Content-Disposition', f"attachment; filename= {os.path.basename(attachment_path)}")
-            msg.attach(part)
-
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, password)
-        text = msg.as_string()
-        server.sendmail(sender_email, receiver_email, text)
-        server.quit()
+            msg.add_attachment(
+                attachment.read(),
+                maintype='audio',
+                subtype='mpeg',
+                filename=os.path.basename(attachment_path)
+            )
+
+        global smtp_server
+        with smtp_lock:
+            try:
+                try:
+                    get_smtp_connection(sender_email, password).send_message(msg, sender_email, receiver_email)
+                except smtplib.SMTPServerDisconnected:
+                    logging.info("SMTP server disconnected, reconnecting")
+                    smtp_server = None
+                    get_smtp_connection(sender_email, password).send_message(msg, sender_email, receiver_email)
+            except (smtplib.SMTPException, OSError):
+                smtp_server = None
+                raise
 
         logging.info("Email sent successfully!")
         return True
@@ -240,11 +308,16 @@ def create_mashup_route():
             logging.warning(f"No videos found for {singer_name}")
             return jsonify({'status': 'error', 'message': f'No videos found for {singer_name}. Please try a different singer name.'})
 
-        with tempfile.TemporaryDirectory() as download_path:
+        videos = [video for video in videos if video[2] >= trim_duration]
+        if not videos:
+            logging.warning(f"No videos of {singer_name} are at least {trim_duration} seconds long")
+            return jsonify({'status': 'error', 'message': f'No videos found for {singer_name} that are at least {trim_duration} seconds long.'})
+
+        with tempfile.TemporaryDirectory(dir=tmp_dir) as download_path:
             logging.info(f"Created temporary directory: {download_path}")
 
            
-            video_urls = [url for _, url in videos]
+            video_urls = [url for _, url, _ in videos]
             logging.info(f"Downloading {len(video_urls)} audio files")
             audio_files = download_all_audio(video_urls, download_path)
 
@@ -261,14 +334,11 @@ def create_mashup_route():
                 logging.error("Failed to create mashup")
                 return jsonify({'status': 'error', 'message': 'Failed to create mashup. Please try again.'})
 
-            zip_file = os.path.join(download_path, "mashup.zip")
-            create_zip_file(mashup_file, zip_file)
-
 
             logging.info(f"Sending email to {receiver_email}")
             subject = f"Your {singer_name} YouTube Mashup"
             body = f"Please find attached your custom YouTube mashup of {singer_name} songs. Duration: {trim_duration * len(audio_files)} seconds."
-            email_sent = send_email(sender_email, receiver_email, subject, body, zip_file, email_password)
+            email_sent = send_email(sender_email, receiver_email, subject, body, mashup_file, email_password)
 
             if email_sent:
                 logging.info("Mashup created and sent successfully")
@@ -283,4 +353,4 @@ def create_mashup_route():
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5900))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get('FLASK_DEBUG') == '1', threaded=True)
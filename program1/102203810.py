@@ -6,8 +6,10 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import multiprocessing
 import subprocess
 import shutil
+import tempfile
 
 num_cores = multiprocessing.cpu_count()
+download_workers = min(num_cores, 8)
 
 def search_youtube_videos(query, max_results=20):
     ydl_opts = {
@@ -29,24 +31,23 @@ def search_youtube_videos(query, max_results=20):
     
     return videos
 
-def download_single_audio(url, index, download_path):
-    output_file = os.path.join(download_path, f'song_{index}.mp3')
+def download_single_audio(url, index, download_path, trim_duration, start_offset=0):
     ydl_opts = {
         'format': 'bestaudio/best',
         'outtmpl': f'{download_path}/song_{index}.%(ext)s',
-        'postprocessors': [{
-            'key': 'FFmpegExtractAudio',
-            'preferredcodec': 'mp3',
-            'preferredquality': '192',
-        }],
+        'buffersize': 65536,
+        'http_chunk_size': 10485760,
+        'concurrent_fragment_downloads': 4,
+        'external_downloader': {'default': 'ffmpeg'},
+        'external_downloader_args': {'ffmpeg_i': ['-ss', str(start_offset), '-t', str(trim_duration)]},
     }
 
     try:
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
-        downloaded_files = [f for f in os.listdir(download_path) if f.startswith(f"song_{index}.") and f.endswith(".mp3")]
-        if downloaded_files:
-            return os.path.join(download_path, downloaded_files[0])
+            info_dict = ydl.extract_info(url, download=True)
+            audio_file = info_dict['requested_downloads'][0]['filepath']
+        if os.path.exists(audio_file):
+            return audio_file
         else:
             print(f"Downloaded file not found for {url}")
             return None
@@ -54,52 +55,40 @@ def download_single_audio(url, index, download_path):
         print(f"Error downloading audio: {e}")
         return None
 
-def download_all_audio(video_urls, download_path):
+def download_all_audio(video_urls, download_path, trim_duration, start_offset=0):
+    video_urls = list(dict.fromkeys(video_urls))
     downloaded_files = []
-    with ThreadPoolExecutor(max_workers=num_cores) as executor:
+    with ThreadPoolExecutor(max_workers=max(1, min(download_workers, len(video_urls)))) as executor:
         futures = {
-            executor.submit(download_single_audio, url, index, download_path): index
+            executor.submit(download_single_audio, url, index, download_path, trim_duration, start_offset): index
             for index, url in enumerate(video_urls, start=1)
         }
 
         for future in as_completed(futures):
             try:
-                mp3_file = future.result()
-                if mp3_file:
-                    downloaded_files.append(mp3_file)
+                audio_file = future.result()
+                if audio_file:
+                    downloaded_files.append(audio_file)
             except Exception as e:
                 print(f"Error occurred: {e}")
 
     return downloaded_files
 
 def create_mashup_ffmpeg(audio_files, output_file, trim_duration):
-    """Create mashup using ffmpeg directly instead of pydub"""
-    concat_file = "concat_list.txt"
-    with open(concat_file, "w") as f:
-        for audio_file in audio_files:
-            trimmed_file = f"{audio_file}.trimmed.mp3"
-            subprocess.run([
-                "ffmpeg", "-y", "-i", audio_file,
-                "-t", str(trim_duration),
-                "-acodec", "copy",
-                trimmed_file
-            ], capture_output=True)
-            f.write(f"file '{trimmed_file}'\n")
-
-    subprocess.run([
-        "ffmpeg", "-y", "-f", "concat",
-        "-safe", "0",
-        "-i", concat_file,
-        "-c", "copy",
-        output_file
-    ], capture_output=True)
-
-    # Clean up temporary files
-    os.remove(concat_file)
-    for audio_file in audio_files:
-        trimmed_file = f"{audio_file}.trimmed.mp3"
-        if os.path.exists(trimmed_file):
-            os.remove(trimmed_file)
+    """Create mashup using a single ffmpeg filter graph instead of pydub"""
+    n = len(audio_files)
+    inputs = sum([["-t", str(trim_duration), "-i", audio_file] for audio_file in audio_files], [])
+    filter_complex = "".join(f"[{i}:a]" for i in range(n)) + f"concat=n={n}:v=0:a=1[out]"
+
+    subprocess.run(
+        ["ffmpeg", "-y"] + inputs + [
+            "-filter_complex", filter_complex,
+            "-map", "[out]",
+            "-b:a", "192k",
+            output_file
+        ],
+        capture_output=True
+    )
 
 def check_dependencies():
     """Check if required dependencies are installed"""
@@ -130,33 +119,25 @@ def main():
         sys.exit(1)
 
     try:
-        temp_dir = "temp_audio_files"
-        os.makedirs(temp_dir, exist_ok=True)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            print(f"Searching for {num_videos} videos of {singer_name}...")
+            video_urls = search_youtube_videos(singer_name, num_videos)
 
-        print(f"Searching for {num_videos} videos of {singer_name}...")
-        video_urls = search_youtube_videos(singer_name, num_videos)
+            if not video_urls:
+                print("No videos found. Exiting.")
+                sys.exit(1)
 
-        if not video_urls:
-            print("No videos found. Exiting.")
-            sys.exit(1)
+            print("Downloading and converting videos to audio...")
+            audio_files = download_all_audio(video_urls, temp_dir, trim_duration)
 
-        print("Downloading and converting videos to audio...")
-        audio_files = download_all_audio(video_urls, temp_dir)
+            if not audio_files:
+                print("No audio files were successfully downloaded. Exiting.")
+                sys.exit(1)
 
-        if not audio_files:
-            print("No audio files were successfully downloaded. Exiting.")
-            sys.exit(1)
+            print(f"Creating mashup with {trim_duration} seconds from each audio...")
+            create_mashup_ffmpeg(audio_files, output_file, trim_duration)
 
-        print(f"Creating mashup with {trim_duration} seconds from each audio...")
-        create_mashup_ffmpeg(audio_files, output_file, trim_duration)
-
-        print(f"Mashup created successfully: {output_file}")
-
-
-        for file in audio_files:
-            if os.path.exists(file):
-                os.remove(file)
-        os.rmdir(temp_dir)
+            print(f"Mashup created successfully: {output_file}")
 
     except Exception as e:
         print(f"An error occurred: {e}")